@@ -1,11 +1,71 @@
 import os
+import functools
+import logging
 from datetime import datetime
+import random
+import stat
 import subprocess
+import time
 import pwd
 import grp
+import requests
+from dotenv import load_dotenv
 
-# Local storage config - Nextcloud directory
-LOCAL_STORAGE_PATH = "/mnt/data/nextcloud/data/bao/files/Photos/reolink-cams/e1"
+logger = logging.getLogger(__name__)
+
+# Read .env before the config below (main.py imports this module before its own load_dotenv())
+load_dotenv()
+
+# Local storage config - Nextcloud directory by default
+LOCAL_STORAGE_PATH = os.getenv('LOCAL_STORAGE_PATH', "/mnt/data/nextcloud/data/bao/files/Photos/reolink-cams/e1")
+
+# Nextcloud integration: permissions/group ownership and rescans (set NEXTCLOUD_ENABLED=0 for plain storage)
+NEXTCLOUD_ENABLED = os.getenv('NEXTCLOUD_ENABLED', '1') == '1'
+TARGET_GROUP = os.getenv('NEXTCLOUD_GROUP', 'www-data')
+
+# Nextcloud rescan config (off by default; run_reolink_motion.sh already scans the whole folder)
+NEXTCLOUD_SCAN_ENABLED = NEXTCLOUD_ENABLED and os.getenv('NEXTCLOUD_SCAN', '0') == '1'
+NEXTCLOUD_DATA_ROOT = os.getenv('NEXTCLOUD_DATA_ROOT', '/mnt/data/nextcloud/data')
+NEXTCLOUD_CONTAINER = os.getenv('NEXTCLOUD_CONTAINER', 'nextcloud-nextcloud-1')
+
+# Resolved once at import; NSS lookups can be slow (LDAP/SSSD). Falls back to the numeric uid,
+# which chown also accepts, when the uid has no passwd entry (common in containers)
+try:
+    CURRENT_USER = pwd.getpwuid(os.getuid()).pw_name
+except KeyError:
+    CURRENT_USER = str(os.getuid())
+
+# Nextcloud's web server group, resolved once (None if the group does not exist on this host)
+try:
+    TARGET_GID = grp.getgrnam(TARGET_GROUP).gr_gid
+except KeyError:
+    TARGET_GID = None
+
+# Suffix for in-progress downloads; renamed to the final name only once complete
+PARTIAL_SUFFIX = '.partial'
+
+# Retry backoff for downloads and fetches (see compute_retry_delay)
+RETRY_BACKOFF_MAX_SECONDS = int(os.getenv('REOLINK_RETRY_BACKOFF_MAX', 600))
+RETRY_JITTER_MAX_SECONDS = int(os.getenv('REOLINK_RETRY_JITTER_MAX', 5))
+
+
+# Directories already created/permissioned during this process: path -> (writable, time.monotonic() of check)
+_ensured_dirs = {}
+ENSURED_DIR_TTL_SECONDS = 3600
+
+# local_file_exists() results: path -> (exists, time.monotonic() of lookup)
+_exists_cache = {}
+EXISTS_CACHE_TTL_SECONDS = 5.0
+
+# list_local_files() results: directory -> (set of filenames, time.monotonic() of scan, names whose size was
+# checked or None for all). Names outside the checked set may be empty files and are answered with a stat instead.
+# Trusted for LISTING_CACHE_TTL_SECONDS, then rescanned; meanwhile every download path adds what it stores via
+# mark_stored(), so only files changed by other processes can be missed until the listing expires.
+_listing_cache = {}
+LISTING_CACHE_TTL_SECONDS = 300
+
+# Directories with new files that Nextcloud still has to index
+_pending_scan_dirs = set()
 
 
 def apply_nextcloud_permissions(path, is_directory=False):
@@ -14,38 +74,89 @@ def apply_nextcloud_permissions(path, is_directory=False):
     - Directories: 775
     - Files: 644
     Tries non-sudo group assignment first, then sudo -n chown as fallback.
+    No-op when NEXTCLOUD_ENABLED is off.
     """
-    mode = 0o775 if is_directory else 0o644
-    os.chmod(path, mode)
+    if not NEXTCLOUD_ENABLED:
+        return
 
-    current_user = pwd.getpwuid(os.getuid()).pw_name
+    mode = 0o775 if is_directory else 0o644
 
-    # Try direct group ownership update first (works if user owns file and is in target group)
+    # chmod + chown through one fd so the path is only resolved once
+    fd = os.open(path, os.O_RDONLY)
     try:
-        www_data_gid = grp.getgrnam('www-data').gr_gid
-        os.chown(path, -1, www_data_gid)
-        print(f"Set group to www-data for {path}")
-        return
-    except Exception:
-        pass
+        os.fchmod(fd, mode)
+
+        # Try direct group ownership update first (works if user owns file and is in target group)
+        if TARGET_GID is not None:
+            try:
+                os.fchown(fd, -1, TARGET_GID)
+                logger.debug("Set group to %s for %s", TARGET_GROUP, path)
+                return
+            except PermissionError:
+                pass
+    finally:
+        os.close(fd)
 
     # Fallback to chgrp (non-sudo)
     try:
-        subprocess.run(['chgrp', 'www-data', path], check=True)
-        print(f"Set group to www-data for {path} via chgrp")
+        subprocess.run(['chgrp', TARGET_GROUP, path], check=True)
+        logger.debug("Set group to %s for %s via chgrp", TARGET_GROUP, path)
         return
     except Exception:
         pass
 
     # Final fallback: non-interactive sudo (never blocks waiting for password)
     try:
-        subprocess.run(['sudo', '-n', 'chown', f'{current_user}:www-data', path], check=True)
-        print(f"Set ownership to {current_user}:www-data for {path}")
+        subprocess.run(['sudo', '-n', 'chown', f'{CURRENT_USER}:{TARGET_GROUP}', path], check=True)
+        logger.debug("Set ownership to %s:%s for %s", CURRENT_USER, TARGET_GROUP, path)
     except subprocess.CalledProcessError:
-        print(f"Warning: Could not set ownership for {path} (sudo -n failed)")
-        print("Grant passwordless chown for this path or add your user to www-data and retry.")
+        logger.warning("Could not set ownership for %s (sudo -n failed)", path)
+        logger.warning("Grant passwordless chown for this path or add your user to %s and retry.", TARGET_GROUP)
     except FileNotFoundError:
-        print(f"Warning: sudo not available, ownership not set for {path}")
+        logger.warning("sudo not available, ownership not set for %s", path)
+
+def _try_stat(path):
+    """Return os.stat_result for path, or None if it does not exist."""
+    try:
+        return os.stat(path)
+    except FileNotFoundError:
+        return None
+
+def _is_regular_file(st):
+    return st is not None and stat.S_ISREG(st.st_mode)
+
+def _is_complete_file(st):
+    """A stored clip counts as present only if it is a non-empty regular file (a 0-byte leftover gets redone)."""
+    return _is_regular_file(st) and st.st_size > 0
+
+def drop_page_cache(path):
+    """
+    Flush a freshly written file and drop it from the page cache.
+    Archived clips are written once and not re-read here, so keeping them cached
+    only evicts hotter pages (Nextcloud DB, metadata).
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        logger.warning("Could not drop page cache for %s: %s", path, e)
+
+def compute_retry_delay(base_delay, attempt):
+    """Exponential backoff with jitter. attempt is zero-based."""
+    exp_delay = min(base_delay * (2 ** attempt), RETRY_BACKOFF_MAX_SECONDS)
+    jitter = random.uniform(0, RETRY_JITTER_MAX_SECONDS)
+    return int(exp_delay + jitter)
+
+@functools.lru_cache(maxsize=64)
+def _date_dir(date):
+    """Storage directory for a date (YYYY-MM-DD), memoized so strftime/join run once per date."""
+    return os.path.join(LOCAL_STORAGE_PATH, date.strftime("%Y-%m-%d"))
 
 def ensure_storage_directory(date=None):
     """
@@ -53,155 +164,238 @@ def ensure_storage_directory(date=None):
     If date is provided, creates a subdirectory for that date.
     Sets proper permissions for Nextcloud access.
     """
-    if date:
-        # Create date-specific directory (YYYY-MM-DD format)
-        date_str = date.strftime("%Y-%m-%d")
-        storage_path = os.path.join(LOCAL_STORAGE_PATH, date_str)
-    else:
-        storage_path = LOCAL_STORAGE_PATH
+    # Date-specific directory (YYYY-MM-DD format) when a date is given
+    storage_path = _date_dir(date) if date else LOCAL_STORAGE_PATH
+
+    cached = _ensured_dirs.get(storage_path)
+    if cached is not None and time.monotonic() - cached[1] < ENSURED_DIR_TTL_SECONDS:
+        return storage_path
     
-    if not os.path.exists(storage_path):
-        os.makedirs(storage_path, exist_ok=True)
+    # EAFP: only a directory we actually created needs permissions applied
+    try:
+        os.makedirs(storage_path)
+    except FileExistsError:
+        pass
+    else:
         apply_nextcloud_permissions(storage_path, is_directory=True)
-        print(f"Created storage directory: {storage_path}")
+        logger.info("Created storage directory: %s", storage_path)
     
+    _ensured_dirs[storage_path] = (os.access(storage_path, os.W_OK), time.monotonic())
     return storage_path
 
-def save_to_local_storage(filepath, date=None):
-    """
-    Move a downloaded file to local storage.
-    If date is provided, saves to a date-specific subdirectory.
-    Returns the new filepath or None on failure.
-    """
-    try:
-        if not os.path.isfile(filepath):
-            print(f"Source file does not exist: {filepath}")
-            return None
-        
-        # Get the filename
-        filename = os.path.basename(filepath)
-        
-        # Ensure storage directory exists
-        storage_path = ensure_storage_directory(date)
-        
-        # Create the destination path
-        destination_path = os.path.join(storage_path, filename)
-        
-        # Check if file already exists
-        if os.path.isfile(destination_path):
-            print(f"File {filename} already exists in local storage, skipping.")
-            # Remove the temporary file
-            os.remove(filepath)
-            return destination_path
-        
-        # Move the file to local storage
-        import shutil
-        shutil.move(filepath, destination_path)
-        
-        apply_nextcloud_permissions(destination_path, is_directory=False)
-        
-        file_size = os.path.getsize(destination_path)
-        print(f"Successfully saved to local storage: {destination_path} ({file_size} bytes)")
-        
-        return destination_path
-        
-    except Exception as e:
-        print(f"Failed to save to local storage: {e}")
-        return None
+def storage_directory_writable(storage_path):
+    """Writability of a directory as recorded by ensure_storage_directory()."""
+    cached = _ensured_dirs.get(storage_path)
+    return cached[0] if cached is not None else os.access(storage_path, os.W_OK)
+
+def clear_ensured_cache():
+    """Forget which storage directories have already been ensured."""
+    _ensured_dirs.clear()
 
 def local_file_exists(filename, date=None):
     """
     Check if a file already exists in local storage.
     If date is provided, checks in the date-specific subdirectory.
     """
-    if date:
-        date_str = date.strftime("%Y-%m-%d")
-        filepath = os.path.join(LOCAL_STORAGE_PATH, date_str, filename)
-    else:
-        filepath = os.path.join(LOCAL_STORAGE_PATH, filename)
-    
-    return os.path.isfile(filepath)
+    filepath = get_local_filepath(filename, date)
+
+    now = time.monotonic()
+    cached = _exists_cache.get(filepath)
+    if cached is not None and now - cached[1] < EXISTS_CACHE_TTL_SECONDS:
+        return cached[0]
+
+    # A recent directory listing answers without another stat, if it size-checked this name
+    listing = _listing_cache.get(os.path.dirname(filepath))
+    if listing is not None and now - listing[1] < LISTING_CACHE_TTL_SECONDS and (
+        listing[2] is None or filename in listing[2]
+    ):
+        return filename in listing[0]
+
+    exists = _is_complete_file(_try_stat(filepath))
+    _exists_cache[filepath] = (exists, now)
+    return exists
+
+def list_local_files(date=None, max_age=None, candidates=None):
+    """
+    Return the set of filenames already in local storage (date subdirectory if date is given).
+    One directory read replaces a stat per candidate when checking many files; the listing is
+    kept so following local_file_exists() calls for the same directory are set lookups.
+    Names in `candidates` (every file if None) are size-checked, and empty ones are left out so a
+    0-byte leftover is downloaded again rather than skipped; other names are listed unchecked.
+    With max_age (seconds), a listing at most that old is returned instead of rescanning, provided it
+    size-checked every name in `candidates`.
+    """
+    directory = _date_dir(date) if date else LOCAL_STORAGE_PATH
+    checked = None if candidates is None else frozenset(candidates)
+    if max_age is not None:
+        cached = _listing_cache.get(directory)
+        if (
+            cached is not None
+            and time.monotonic() - cached[1] < max_age
+            and (cached[2] is None or (checked is not None and checked <= cached[2]))
+        ):
+            return cached[0]
+    names = set()
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.name.endswith(PARTIAL_SUFFIX) or not entry.is_file():
+                    continue
+                if checked is None or entry.name in checked:
+                    try:
+                        if entry.stat().st_size == 0:
+                            continue
+                    except FileNotFoundError:
+                        continue  # Removed while we were listing
+                names.add(entry.name)
+    except FileNotFoundError:
+        pass
+    _listing_cache[directory] = (names, time.monotonic(), checked)
+    return names
+
+def discard_partial(path):
+    """Remove a leftover partial download, if any."""
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+def mark_stored(filepath):
+    """Record a freshly stored file so local_file_exists() doesn't serve a stale negative."""
+    _exists_cache[filepath] = (True, time.monotonic())
+    directory, name = os.path.split(filepath)
+    listing = _listing_cache.get(directory)
+    if listing is not None:
+        names, scanned_at, checked = listing
+        names.add(name)
+        if checked is not None:
+            # Stored complete by this process, so its size is known to be non-zero
+            _listing_cache[directory] = (names, scanned_at, checked | {name})
 
 def get_local_filepath(filename, date=None):
     """
     Get the full path where a file should be stored locally.
     If date is provided, returns path in date-specific subdirectory.
     """
-    if date:
-        date_str = date.strftime("%Y-%m-%d")
-        return os.path.join(LOCAL_STORAGE_PATH, date_str, filename)
-    else:
-        return os.path.join(LOCAL_STORAGE_PATH, filename)
+    return os.path.join(_date_dir(date) if date else LOCAL_STORAGE_PATH, filename)
+
+def finalize_download(partial_filepath, local_filepath):
+    """
+    Move a finished .partial download into place and publish it (permissions, Nextcloud scan, caches).
+    Returns the stored size in bytes; raises if the partial file is missing or empty.
+    """
+    st = _try_stat(partial_filepath)
+    if not _is_complete_file(st):
+        raise Exception("Download completed but file is missing or empty")
+    drop_page_cache(partial_filepath)
+    os.replace(partial_filepath, local_filepath)
+    apply_nextcloud_permissions(local_filepath, is_directory=False)
+    queue_nextcloud_scan(local_filepath)
+    mark_stored(local_filepath)
+    return st.st_size
 
-def download_to_local_storage(cam, fname, output_filename, date=None, max_retries=5, retry_delay=30):
+def download_to_local_storage(cam, fname, output_filename, date=None, max_retries=5, retry_delay=30, relogin=None):
     """
     Download a file directly to local storage.
     This replaces the download + upload pattern with direct local storage.
+    relogin: optional callable returning a freshly logged-in camera, used for the last attempt
+    in case the session expired mid-run.
     """
-    import time
-    import requests
-    
     # Get the destination path
     local_filepath = get_local_filepath(output_filename, date)
     
     # Check if file already exists
-    if os.path.isfile(local_filepath):
-        print(f"File {output_filename} already exists in local storage, skipping download.")
+    if _is_complete_file(_try_stat(local_filepath)):
+        logger.info("File %s already exists in local storage, skipping download.", output_filename)
         return local_filepath
     
     # Ensure storage directory exists with proper permissions
     storage_path = ensure_storage_directory(date)
     
     # Double-check we can write to the directory
-    if not os.access(storage_path, os.W_OK):
-        print(f"ERROR: Cannot write to directory {storage_path}")
-        print("Please run: sudo chown -R $USER:www-data /mnt/data/nextcloud/data/bao/files/Photos/reolink-cams/e1")
-        print("And: sudo chmod -R 775 /mnt/data/nextcloud/data/bao/files/Photos/reolink-cams/e1")
+    if not storage_directory_writable(storage_path):
+        logger.error("Cannot write to directory %s", storage_path)
+        logger.error("Please run: sudo chown -R $USER:%s %s", TARGET_GROUP, LOCAL_STORAGE_PATH)
+        logger.error("And: sudo chmod -R 775 %s", LOCAL_STORAGE_PATH)
         return None
     
-    print(f"Downloading {fname} directly to {local_filepath}")
-    print(f"Debug: Starting download attempt...")
+    logger.info("Downloading %s directly to %s", fname, local_filepath)
+    logger.debug("Starting download attempt...")
+    # Download next to the target and rename on success, so an existing file is always complete
+    partial_filepath = local_filepath + PARTIAL_SUFFIX
     attempt = 0
     while attempt < max_retries:
         try:
             # Try to download with increased timeout
-            print(f"Debug: Attempting download with timeout...")
-            resp = cam.get_file(fname, output_path=local_filepath)
-            
+            logger.debug("Attempting download with timeout...")
+            if relogin is not None and 0 < attempt == max_retries - 1:
+                logger.info("Last attempt for %s: logging in again first", fname)
+                cam = relogin()
+            # get_file() returns False on a non-200 response (status not exposed) instead of raising
+            if not cam.get_file(fname, output_path=partial_filepath):
+                raise Exception("camera returned a non-200 response")
+
             # If we get here, download was successful
-            if os.path.isfile(local_filepath):
-                apply_nextcloud_permissions(local_filepath, is_directory=False)
-                file_size = os.path.getsize(local_filepath)
-                print(f"Successfully downloaded to local storage: {local_filepath} ({file_size} bytes)")
-                
-                return local_filepath
-            else:
-                raise Exception("Download completed but file not found")
-                
+            file_size = finalize_download(partial_filepath, local_filepath)
+            logger.info("Successfully downloaded to local storage: %s (%d bytes)", local_filepath, file_size)
+            return local_filepath
+
         except requests.exceptions.ReadTimeout:
             attempt += 1
             if attempt < max_retries:
-                print(f"Timeout while downloading {fname}. Retrying {attempt}/{max_retries} in {retry_delay}s...")
-                time.sleep(retry_delay)
+                delay = compute_retry_delay(retry_delay, attempt - 1)
+                logger.warning("Timeout while downloading %s. Retrying %d/%d in %ds...", fname, attempt, max_retries, delay)
+                time.sleep(delay)
             else:
-                print(f"Failed to download {fname} after {max_retries} attempts due to timeouts.")
+                logger.error("Failed to download %s after %d attempts due to timeouts.", fname, max_retries)
                 
         except requests.exceptions.RequestException as e:
             attempt += 1
             if attempt < max_retries:
-                print(f"Network error while downloading {fname}: {e}. Retrying {attempt}/{max_retries} in {retry_delay}s...")
-                time.sleep(retry_delay)
+                delay = compute_retry_delay(retry_delay, attempt - 1)
+                logger.warning("Network error while downloading %s: %s. Retrying %d/%d in %ds...", fname, e, attempt, max_retries, delay)
+                time.sleep(delay)
             else:
-                print(f"Failed to download {fname} after {max_retries} attempts due to network errors.")
+                logger.error("Failed to download %s after %d attempts due to network errors.", fname, max_retries)
                 
         except Exception as e:
             attempt += 1
             if attempt < max_retries:
-                print(f"Error while downloading {fname}: {e}. Retrying {attempt}/{max_retries} in {retry_delay}s...")
-                time.sleep(retry_delay)
+                delay = compute_retry_delay(retry_delay, attempt - 1)
+                logger.warning("Error while downloading %s: %s. Retrying %d/%d in %ds...", fname, e, attempt, max_retries, delay)
+                time.sleep(delay)
             else:
-                print(f"Failed to download {fname} after {max_retries} attempts due to unexpected error.")
+                logger.error("Failed to download %s after %d attempts due to unexpected error.", fname, max_retries)
+
+        finally:
+            discard_partial(partial_filepath)
     
     return None 
 
-# Remove the trigger_nextcloud_scan function (lines 204-241) and any references to it in the file 
\ No newline at end of file
+def queue_nextcloud_scan(filepath):
+    """Remember the directory of a newly stored file so it gets scanned on the next flush."""
+    _pending_scan_dirs.add(os.path.dirname(filepath))
+
+def flush_nextcloud_scans():
+    """
+    Run one `occ files:scan` per directory queued via queue_nextcloud_scan().
+    Batching amortizes the PHP startup cost across every file in a directory.
+    """
+    if not _pending_scan_dirs:
+        return
+    if not NEXTCLOUD_SCAN_ENABLED:
+        _pending_scan_dirs.clear()
+        return
+
+    for scan_dir in sorted(_pending_scan_dirs):
+        scan_path = os.path.relpath(scan_dir, NEXTCLOUD_DATA_ROOT)
+        try:
+            subprocess.run(
+                ['docker', 'exec', NEXTCLOUD_CONTAINER, 'php', 'occ', 'files:scan', f'--path={scan_path}'],
+                check=True,
+            )
+            logger.info("Triggered Nextcloud scan for %s", scan_path)
+        except (subprocess.CalledProcessError, FileNotFoundError) as e:
+            logger.warning("Nextcloud scan failed for %s: %s", scan_path, e)
+    _pending_scan_dirs.clear()
+ 
\ No newline at end of file
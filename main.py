@@ -1,17 +1,30 @@
 import os
 from dotenv import load_dotenv
 import json
-from datetime import datetime
+from datetime import datetime, time as dttime, timedelta
 from reolinkapi import Camera
 import urllib3
-import requests
 import argparse
+import logging
+import sys
 from telegram import Bot
 import asyncio
 import time
 import random
 import signal
-from local_storage import download_to_local_storage, local_file_exists, ensure_storage_directory, get_local_filepath, apply_nextcloud_permissions
+import threading
+import atexit
+import functools
+import logging.handlers
+import queue
+from bisect import bisect_right
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from reolink_aio.api import Host
+except ImportError:  # only required when REOLINK_CLIENT=aio
+    Host = None
+from local_storage import download_to_local_storage, finalize_download, compute_retry_delay, local_file_exists, list_local_files, ensure_storage_directory, get_local_filepath, discard_partial, PARTIAL_SUFFIX, flush_nextcloud_scans, LISTING_CACHE_TTL_SECONDS
 
 # Configuration: Dynamic timeout and retry strategies (configurable via environment variables)
 TIMEOUT_BASE_SECONDS = int(os.getenv('REOLINK_TIMEOUT_BASE', 1800))  # 30 min base
@@ -19,8 +32,17 @@ TIMEOUT_PER_FILE_SECONDS = int(os.getenv('REOLINK_TIMEOUT_PER_FILE', 120))  # 2
 TIMEOUT_MAX_SECONDS = int(os.getenv('REOLINK_TIMEOUT_MAX', 14400))  # 4 hours max
 MAX_RETRIES = int(os.getenv('REOLINK_MAX_RETRIES', 5))
 RETRY_DELAY_BASE = int(os.getenv('REOLINK_RETRY_DELAY_BASE', 30))  # Base delay in seconds
-RETRY_BACKOFF_MAX_SECONDS = int(os.getenv('REOLINK_RETRY_BACKOFF_MAX', 600))
-RETRY_JITTER_MAX_SECONDS = int(os.getenv('REOLINK_RETRY_JITTER_MAX', 5))
+DOWNLOAD_CONCURRENCY = max(1, int(os.getenv('REOLINK_DOWNLOAD_CONCURRENCY', 4)))  # Parallel clip downloads (reolink-aio)
+# reolinkapi buffers each whole clip in RAM before writing it, so legacy downloads default to one at a time
+LEGACY_DOWNLOAD_CONCURRENCY = int(os.getenv('REOLINK_LEGACY_DOWNLOAD_CONCURRENCY', 1))
+# Sizes are in KiB and clamped to at least 1 KiB: a 0-byte read would end every stream at once
+DOWNLOAD_CHUNK_SIZE = max(1, int(os.getenv('REOLINK_DOWNLOAD_CHUNK_KB', 1024))) * 1024  # Reads from the VOD stream
+WRITE_BUFFER_SIZE = max(1, int(os.getenv('REOLINK_WRITE_BUFFER_KB', 2048))) * 1024  # Writer buffer -> fewer, larger write() syscalls
+# Default stream types for the fetch_motion_files/download_video probes; pass ('main', 'sub') to compare streams
+PROBE_STREAMTYPES = ('main',)
+INDEXING_WAIT_MAX_SECONDS = 10  # Cap for re-polling today's (possibly still indexing) motions
+MOTION_CHANNELS = (0, 1, 2, 3)
+QUERY_WORKERS = 4  # Concurrent NVR search requests (one per channel)
 
 def calculate_estimated_timeout(file_count):
     """
@@ -31,13 +53,6 @@ def calculate_estimated_timeout(file_count):
     return min(estimated, TIMEOUT_MAX_SECONDS)
 
 
-def compute_retry_delay(base_delay, attempt):
-    """Exponential backoff with jitter. attempt is zero-based."""
-    exp_delay = min(base_delay * (2 ** attempt), RETRY_BACKOFF_MAX_SECONDS)
-    jitter = random.uniform(0, RETRY_JITTER_MAX_SECONDS)
-    return int(exp_delay + jitter)
-
-
 def is_retryable_exception(exc):
     msg = str(exc).lower()
     retryable_markers = [
@@ -56,6 +71,8 @@ def is_retryable_exception(exc):
 # WORKING DEBUG VERSION: Fetches and downloads all motion files for today (midnight to now) for all channels (0-3), 'main' stream only.
 # Use this as a reference point for a known good state.
 
+logger = logging.getLogger(__name__)
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -71,7 +88,32 @@ USE_AIO_CLIENT = REOLINK_CLIENT == 'aio'
 # Telegram config
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
+TELEGRAM_SEND_TIMEOUT_SECONDS = 60  # Covers the 3 send attempts with 5s pauses
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096  # Bot API limit per message
+
+# Progress lines held back and sent together with the terminal status (see accumulate_notification)
+_PENDING_NOTIFICATIONS = []
+
+# One Bot + event loop shared by all notifications (see _get_telegram_loop)
+_TELEGRAM_LOOP = None
+_TELEGRAM_BOT = None
+_TELEGRAM_LOCK = threading.Lock()
+_TELEGRAM_PENDING = set()  # Sends not finished yet (see _close_telegram)
+_TELEGRAM_SEND_ORDER = None  # asyncio.Lock keeping messages in submission order
 
+# One logged-in legacy Camera shared by the whole run (see get_camera)
+_CAMERA = None
+_CAMERA_LOCK = threading.Lock()
+_RETIRED_CAMERAS = []  # Logins dropped while other download workers may still use them; logged out at exit
+
+# Run-wide reolink-aio event loop and logged-in Host (see _run_aio / _get_aio_host)
+_AIO_LOOP = None
+_AIO_HOST = None
+
+# Worker pool for the per-channel NVR queries, kept for the whole run so date ranges don't respawn threads
+_QUERY_EXECUTOR = ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix='nvr-query')
+
+# The camera's certificate is self-signed and neither client verifies it, so silence the per-request warning
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 # Job lifecycle state (for robust terminal status signaling)
@@ -80,101 +122,295 @@ JOB_RUN_ID = None
 TERMINAL_STATUS_SENT = False
 
 
+def setup_logging():
+    """
+    Route all log records through a QueueHandler so download threads and the
+    event loop never block on stdout; one QueueListener thread does the writes.
+    Level comes from LOG_LEVEL (default INFO). Returns the started listener.
+    """
+    log_queue = queue.Queue(-1)
+    # Plain messages on stdout so cron.log keeps the same shape as print() output
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter('%(message)s'))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    root = logging.getLogger()
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener.start()
+    atexit.register(listener.stop)  # flushes whatever is still queued
+    return listener
+
+
 def _termination_handler(signum, frame):
     global TERMINATION_SIGNAL
     TERMINATION_SIGNAL = signum
     raise KeyboardInterrupt(f"Termination signal received: {signum}")
 
-def download_video(start_dt, end_dt):
+def download_video(start_dt, end_dt, streamtypes=None):
     """
     Query available playback files from Reolink camera for the given time range.
-    Tries both channel 0 and 1, and both streamtype 'main' (Clear) and 'sub' (Fluent).
-    Prints results for each combination.
+    Tries both channel 0 and 1, and each of streamtypes (default: PROBE_STREAMTYPES, i.e. 'main' (Clear);
+    'sub' is Fluent).
+    Prints results for each combination; the combinations are queried in parallel.
     """
+    streamtypes = streamtypes or PROBE_STREAMTYPES
     try:
-        cam = Camera(REOLINK_HOST, REOLINK_USER, REOLINK_PASSWORD, https=True, defer_login=True)
-        cam.login()
+        cam = get_camera()
+        combos = [(channel, streamtype) for channel in [0, 1] for streamtype in streamtypes]
+
+        def _query(combo):
+            channel, streamtype = combo
+            return cam.get_playback_files(
+                start=start_dt,
+                end=end_dt,
+                channel=channel,
+                streamtype=streamtype
+            )
+
         found_any = False
-        for channel in [0, 1]:
-            for streamtype in ['main', 'sub']:
-                files = cam.get_playback_files(
-                    start=start_dt,
-                    end=end_dt,
-                    channel=channel,
-                    streamtype=streamtype
-                )
-                print(f"Playback files from {start_dt} to {end_dt} | channel {channel} | streamtype '{streamtype}': {files}")
-                if files:
-                    found_any = True
+        for (channel, streamtype), files in zip(combos, _QUERY_EXECUTOR.map(_query, combos)):
+            logger.info("Playback files from %s to %s | channel %s | streamtype '%s': %s", start_dt, end_dt, channel, streamtype, files)
+            if files:
+                found_any = True
         if not found_any:
-            print("No playback files found for any channel/streamtype combination.")
+            logger.info("No playback files found for any channel/streamtype combination.")
     except Exception as e:
-        print(f"Download failed: {e}")
+        logger.error("Download failed: %s", e)
         return None
 
 
-async def _aio_download_file_to_local_storage(fname, output_filename, target_date, max_retries=5, retry_delay=30):
-    """Download one VOD file using reolink-aio and save directly to local storage."""
-    from reolink_aio.api import Host
+def _run_aio(coro):
+    """
+    Run a coroutine on the run-wide reolink-aio event loop.
+    The shared Host's HTTP session is bound to this loop, so every aio call goes through here
+    instead of asyncio.run(), which would start (and tear down) a fresh loop each time.
+    """
+    global _AIO_LOOP
+    if _AIO_LOOP is None:
+        _AIO_LOOP = asyncio.new_event_loop()
+        atexit.register(_close_aio)
+    return _AIO_LOOP.run_until_complete(coro)
 
+
+async def _get_aio_host():
+    """Return the run's logged-in reolink-aio Host, creating it on first use (one login for fetches and downloads)."""
+    global _AIO_HOST
+    if _AIO_HOST is None:
+        host = Host(REOLINK_HOST, REOLINK_USER, REOLINK_PASSWORD, use_https=None, port=None, stream='main', timeout=15)
+        await host.login()
+        await host.get_host_data()
+        _AIO_HOST = host
+    return _AIO_HOST
+
+
+async def _reset_aio_host():
+    """Log out and drop the shared Host so the next _get_aio_host() logs in again."""
+    global _AIO_HOST
+    host, _AIO_HOST = _AIO_HOST, None
+    if host is not None:
+        try:
+            await host.logout()
+        except Exception:
+            pass
+
+
+def _close_aio():
+    if _AIO_LOOP is None:
+        return
+    try:
+        _AIO_LOOP.run_until_complete(_reset_aio_host())
+    finally:
+        _AIO_LOOP.close()
+
+
+async def _aio_download_file_to_local_storage(host, fname, output_filename, target_date, max_retries=5, retry_delay=30):
+    """Download one VOD file using an already logged-in reolink-aio Host and save directly to local storage."""
     local_filepath = get_local_filepath(output_filename, target_date)
-    if os.path.isfile(local_filepath):
+    if local_file_exists(output_filename, target_date):
         return local_filepath
 
     ensure_storage_directory(target_date)
+    partial_filepath = local_filepath + PARTIAL_SUFFIX
 
     for attempt in range(max_retries):
-        host = Host(REOLINK_HOST, REOLINK_USER, REOLINK_PASSWORD, use_https=None, port=None, stream='main', timeout=15)
         vod = None
         try:
-            await host.login()
-            await host.get_host_data()
             vod = await host.download_vod(fname, wanted_filename=output_filename)
 
-            with open(local_filepath, 'wb') as f:
+            with open(partial_filepath, 'wb', buffering=WRITE_BUFFER_SIZE) as f:
                 while True:
-                    chunk = await vod.stream.read(1024 * 1024)
+                    chunk = await vod.stream.read(DOWNLOAD_CHUNK_SIZE)
                     if not chunk:
                         break
-                    f.write(chunk)
+                    # Keep the event loop free for the other concurrent downloads
+                    await asyncio.to_thread(f.write, chunk)
 
             try:
                 vod.close()
             except Exception:
                 pass
 
-            apply_nextcloud_permissions(local_filepath, is_directory=False)
-            file_size = os.path.getsize(local_filepath)
-            print(f"Successfully downloaded to local storage: {local_filepath} ({file_size} bytes)")
+            # fsync, rename and chown block, so keep them off the event loop
+            file_size = await asyncio.to_thread(finalize_download, partial_filepath, local_filepath)
+            logger.info("Successfully downloaded to local storage: %s (%s bytes)", local_filepath, file_size)
             return local_filepath
         except Exception as e:
             if attempt < max_retries - 1 and is_retryable_exception(e):
                 delay = compute_retry_delay(retry_delay, attempt)
-                print(f"AIO download error for {fname}: {e}. Retrying {attempt + 1}/{max_retries} in {delay}s...")
+                logger.warning("AIO download error for %s: %s. Retrying %s/%s in %ss...", fname, e, attempt + 1, max_retries, delay)
                 await asyncio.sleep(delay)
             else:
-                print(f"Failed to download {fname} after {attempt + 1}/{max_retries} attempts via reolink-aio: {e}")
+                logger.error("Failed to download %s after %s/%s attempts via reolink-aio: %s", fname, attempt + 1, max_retries, e)
                 if not is_retryable_exception(e):
-                    print("Non-retryable AIO error encountered, aborting retries for this file.")
+                    logger.error("Non-retryable AIO error encountered, aborting retries for this file.")
                 break
         finally:
+            discard_partial(partial_filepath)
             try:
                 if vod is not None:
                     vod.close()
             except Exception:
                 pass
-            try:
-                await host.logout()
-            except Exception:
-                pass
 
     return None
 
 
+async def _aio_download_many(jobs, max_retries, retry_delay, concurrency=DOWNLOAD_CONCURRENCY):
+    """
+    Download (fname, output_filename, target_date) jobs concurrently over the run's reolink-aio login.
+    At most `concurrency` downloads are in flight at once.
+    Returns local paths (or None for failures) in job order.
+    """
+    host = await _get_aio_host()
+    sem = asyncio.Semaphore(concurrency)
+
+    async def _one(fname, output_filename, target_date):
+        async with sem:
+            return await _aio_download_file_to_local_storage(
+                host, fname, output_filename, target_date, max_retries=max_retries, retry_delay=retry_delay
+            )
+
+    return await asyncio.gather(*(_one(*job) for job in jobs))
+
+
+def motion_output_filename(motion):
+    """Local filename for a motion clip: '<YYYY-MM-DD HH-MM-SS>_ch<channel>.mp4' (channel defaults to 0)."""
+    return motion['start'].strftime("%Y-%m-%d %H-%M-%S") + f"_ch{motion.get('channel', 0)}.mp4"
+
+
+def _login_legacy_camera():
+    """
+    Create a reolinkapi Camera and log in.
+    The login token stays valid across requests, so the camera can be reused across downloads.
+    Raises if login fails, including when the camera rejects the credentials (login() returns False).
+    """
+    cam = Camera(
+        REOLINK_HOST,
+        REOLINK_USER,
+        REOLINK_PASSWORD,
+        https=True,
+        defer_login=True,
+        timeout=60  # Increase timeout to 60 seconds for large files
+    )
+    if not cam.login():
+        raise Exception("Camera rejected the login; check REOLINK_USER/REOLINK_PASSWORD")
+    return cam
+
+
+def _logout_quietly(cam):
+    if cam is None:
+        return
+    try:
+        cam.logout()
+    except Exception:
+        pass
+
+
+def get_camera():
+    """
+    Return the run's shared legacy Camera, logging in on first use.
+    Every query and download reuses this one login instead of paying an auth round-trip
+    per channel or file; it is logged out at exit.
+    Raises if login fails.
+    """
+    global _CAMERA
+    with _CAMERA_LOCK:
+        if _CAMERA is None:
+            _CAMERA = _login_legacy_camera()
+            logger.info("Login success")
+            atexit.unregister(reset_camera)  # Registered once however often the run logs in again
+            atexit.register(reset_camera)
+        return _CAMERA
+
+
+def reset_camera(stale=None):
+    """
+    Drop the shared Camera so the next get_camera() logs in again.
+    With `stale` (a download giving up on its login), only drop it if it is still that camera, so concurrent
+    workers don't each force a re-login. It is not logged out yet: the other workers share its token and may
+    be mid-download, so it is retired and logged out at exit.
+    Without `stale` (no downloads in flight, or at exit), log out the current and all retired cameras.
+    """
+    global _CAMERA
+    with _CAMERA_LOCK:
+        if stale is not None:
+            if _CAMERA is stale:
+                _CAMERA = None
+                _RETIRED_CAMERAS.append(stale)
+            return
+        cams = [_CAMERA, *_RETIRED_CAMERAS]
+        _CAMERA = None
+        _RETIRED_CAMERAS.clear()
+    for cam in cams:
+        _logout_quietly(cam)
+
+
+def relogin_camera(stale):
+    """Drop `stale` as the shared Camera and return a freshly logged-in one (for a download's last attempt)."""
+    reset_camera(stale)
+    return get_camera()
+
+
+# Result placeholder for legacy jobs that were never attempted because a login failed
+_NOT_STARTED = object()
+
+
+def _legacy_download_many(jobs, max_retries, retry_delay, concurrency=LEGACY_DOWNLOAD_CONCURRENCY):
+    """
+    Download (fname, output_filename, target_date) jobs with reolinkapi, `concurrency` at a time.
+    Each download is a stateless token GET, so all workers share the run's get_camera() login.
+    reolinkapi holds a whole clip in memory while saving it, which is why the default is one at a time.
+    download_to_local_storage() retries each file, the last attempt on a fresh login.
+    Returns results in job order: the local path, None on failure, or _NOT_STARTED once a login has failed.
+    """
+    login_failed = threading.Event()
+
+    def _download_one(job):
+        if login_failed.is_set():
+            return _NOT_STARTED
+        try:
+            cam = get_camera()
+        except Exception as e:
+            if not login_failed.is_set():
+                login_failed.set()
+                logger.error("Login failed, stopping this run's downloads: %s", e)
+            return _NOT_STARTED
+
+        fname, output_filename, target_date = job
+        logger.info("Downloading %s as %s", fname, output_filename)
+        return download_to_local_storage(
+            cam, fname, output_filename, target_date, max_retries, retry_delay,
+            relogin=functools.partial(relogin_camera, cam),
+        )
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='legacy-download') as executor:
+        return list(executor.map(_download_one, jobs))
+
+
 def download_motion_files(motions, max_retries=None, retry_delay=None):
     """
     Download motion files and save them to local storage.
-    Only processes channel 0 files.
+    Handles motions from any channel; each clip is stored as motion_output_filename() ('..._ch<channel>.mp4').
     Uses increased timeouts and retry delays for better reliability.
     Retry strategies are configurable via environment variables.
     """
@@ -185,198 +421,88 @@ def download_motion_files(motions, max_retries=None, retry_delay=None):
         retry_delay = RETRY_DELAY_BASE
 
     total_files = len(motions)
-    files_to_download = sum(1 for m in motions if not local_file_exists(
-        m['start'].strftime("%Y-%m-%d %H-%M-%S") + "_ch0.mp4",
-        m['start'].date()
-    ))
-
-    # Log estimated timeout
-    if files_to_download > 0:
-        estimated_timeout = calculate_estimated_timeout(files_to_download)
-        timeout_minutes = estimated_timeout // 60
-        print(f"Estimated processing time: ~{timeout_minutes} minutes for {files_to_download} files to download")
-
     processed_count = 0
     downloaded_count = 0
     skipped_count = 0
     failed_count = 0
 
-    for idx, motion in enumerate(motions, 1):
-        fname = motion['filename']
-        mstart = motion['start']
-        output_filename = mstart.strftime("%Y-%m-%d %H-%M-%S") + "_ch0.mp4"
-        target_date = mstart.date()
+    # Plan everything up front: one directory listing per date (read lazily) instead of a stat per motion,
+    # so the download phase only sees work that actually needs doing
+    wanted_by_date = {}
+    for motion in motions:
+        wanted_by_date.setdefault(motion['start'].date(), set()).add(motion_output_filename(motion))
+    local_files_by_date = {}
+    pending = []
+    for motion in motions:
+        output_filename = motion_output_filename(motion)
+        target_date = motion['start'].date()
+
+        if target_date not in local_files_by_date:
+            local_files_by_date[target_date] = list_local_files(
+                target_date, max_age=LISTING_CACHE_TTL_SECONDS, candidates=wanted_by_date[target_date]
+            )
 
-        if local_file_exists(output_filename, target_date):
+        if output_filename in local_files_by_date[target_date]:
             skipped_count += 1
-            processed_count += 1
-            print(f"[{processed_count}/{total_files}] File {output_filename} already exists in local storage, skipping download.")
             continue
+        pending.append((motion['filename'], output_filename, target_date))
 
-        print(f"[{processed_count + 1}/{total_files}] Downloading {fname} as {output_filename}")
+    processed_count += skipped_count
+    if skipped_count:
+        logger.info("Skipping %s/%s files already in local storage.", skipped_count, total_files)
 
-        if USE_AIO_CLIENT:
-            result = asyncio.run(
-                _aio_download_file_to_local_storage(
-                    fname=fname,
-                    output_filename=output_filename,
-                    target_date=target_date,
-                    max_retries=max_retries,
-                    retry_delay=retry_delay,
-                )
-            )
+    # Log estimated timeout
+    files_to_download = len(pending)
+    if files_to_download > 0:
+        estimated_timeout = calculate_estimated_timeout(files_to_download)
+        timeout_minutes = estimated_timeout // 60
+        logger.info("Estimated processing time: ~%s minutes for %s files to download", timeout_minutes, files_to_download)
+
+    if USE_AIO_CLIENT and pending:
+        logger.info("Downloading %s files via reolink-aio (%s at a time)", len(pending), DOWNLOAD_CONCURRENCY)
+        try:
+            results = _run_aio(_aio_download_many(pending, max_retries, retry_delay))
+        except Exception as e:
+            logger.error("reolink-aio login failed: %s", e)
+            results = [None] * len(pending)
+        for (fname, output_filename, target_date), result in zip(pending, results):
             processed_count += 1
             if result:
                 downloaded_count += 1
-                print(f"[{processed_count}/{total_files}] Successfully downloaded to local storage: {result}")
+                logger.info("[%s/%s] Successfully downloaded to local storage: %s", processed_count, total_files, result)
             else:
                 failed_count += 1
-                print(f"[{processed_count}/{total_files}] Failed to download {fname} via reolink-aio")
-            continue
-
-        attempt = 0
-        while attempt < max_retries:
-            cam = None
-            try:
-                # Create a new camera connection with increased timeout
-                cam = Camera(
-                    REOLINK_HOST,
-                    REOLINK_USER,
-                    REOLINK_PASSWORD,
-                    https=True,
-                    defer_login=True,
-                    timeout=60  # Increase timeout to 60 seconds for large files
-                )
-
-                # Try to login with retries
-                login_attempt = 0
-                while login_attempt < 3:  # 3 login retries
-                    try:
-                        cam.login()
-                        print(f"Login success - Download attempt {attempt + 1}/{max_retries}")
-                        break
-                    except Exception as e:
-                        login_attempt += 1
-                        if login_attempt < 3:
-                            print(f"Login failed, retrying {login_attempt}/3...")
-                            time.sleep(5)  # Short delay between login attempts
-                        else:
-                            raise Exception(f"Failed to login after 3 attempts: {e}")
-
-                # Configure session for streaming
-                session = requests.Session()
-                session.verify = False
-                session.timeout = (30, 180)  # 30s connect timeout, 180s read timeout (3 minutes for large files)
-                cam._session = session
-
-                # Download directly to local storage
-                result = download_to_local_storage(cam, fname, output_filename, target_date, max_retries, retry_delay)
-                if result:
-                    downloaded_count += 1
-                    processed_count += 1
-                    print(f"[{processed_count}/{total_files}] Successfully downloaded to local storage: {result}")
-                    if cam:
-                        try:
-                            cam.logout()
-                        except:
-                            pass
-                    break  # Success, exit retry loop
-                else:
-                    # Download failed, increment attempt and retry
-                    attempt += 1
-                    if attempt < max_retries:
-                        # Exponential backoff: 30s, 60s, 120s, 240s
-                        delay = compute_retry_delay(retry_delay, attempt - 1)
-                        print(f"Download to local storage failed. Retrying {attempt}/{max_retries} in {delay}s...")
-                        time.sleep(delay)
-                    else:
-                        print(f"Failed to download {fname} after {max_retries} attempts.")
-                        processed_count += 1
-                        failed_count += 1
-                    continue
-
-            except requests.exceptions.ReadTimeout:
-                attempt += 1
-                if cam:
-                    try:
-                        cam.logout()
-                    except:
-                        pass
-                if attempt < max_retries:
-                    # Exponential backoff for timeouts
-                    delay = compute_retry_delay(retry_delay, attempt - 1)
-                    print(f"Timeout while downloading {fname}. Retrying {attempt}/{max_retries} in {delay}s...")
-                    time.sleep(delay)
-                else:
-                    print(f"Failed to download {fname} after {max_retries} attempts due to timeouts.")
-                    processed_count += 1
-                    failed_count += 1
-                    continue
-
-            except requests.exceptions.ConnectionError as e:
-                attempt += 1
-                if cam:
-                    try:
-                        cam.logout()
-                    except:
-                        pass
-                if attempt < max_retries:
-                    # Exponential backoff for connection errors
-                    delay = compute_retry_delay(retry_delay, attempt - 1)
-                    print(f"Connection error while downloading {fname}: {e}. Retrying {attempt}/{max_retries} in {delay}s...")
-                    time.sleep(delay)
-                else:
-                    print(f"Failed to download {fname} after {max_retries} attempts due to connection errors.")
-                    processed_count += 1
-                    failed_count += 1
-                    continue
-
-            except requests.exceptions.RequestException as e:
-                attempt += 1
-                if cam:
-                    try:
-                        cam.logout()
-                    except:
-                        pass
-                if attempt < max_retries:
-                    # Exponential backoff for network errors
-                    delay = compute_retry_delay(retry_delay, attempt - 1)
-                    print(f"Network error while downloading {fname}: {e}. Retrying {attempt}/{max_retries} in {delay}s...")
-                    time.sleep(delay)
-                else:
-                    print(f"Failed to download {fname} after {max_retries} attempts due to network errors.")
-                    processed_count += 1
-                    failed_count += 1
-                    continue
-
-            except Exception as e:
-                attempt += 1
-                if cam:
-                    try:
-                        cam.logout()
-                    except:
-                        pass
-                if attempt < max_retries:
-                    # Exponential backoff for unexpected errors
-                    delay = compute_retry_delay(retry_delay, attempt - 1)
-                    print(f"Error while downloading {fname}: {e}. Retrying {attempt}/{max_retries} in {delay}s...")
-                    time.sleep(delay)
-                else:
-                    print(f"Failed to download {fname} after {max_retries} attempts due to unexpected error.")
-                    processed_count += 1
-                    failed_count += 1
-                    continue
+                logger.error("[%s/%s] Failed to download %s via reolink-aio", processed_count, total_files, fname)
+        pending = []
+
+    # Legacy client: download_to_local_storage retries each file itself
+    if pending:
+        logger.info("Downloading %s files via reolinkapi (%s at a time)", len(pending), LEGACY_DOWNLOAD_CONCURRENCY)
+        results = _legacy_download_many(pending, max_retries, retry_delay)
+        for (fname, output_filename, target_date), result in zip(pending, results):
+            processed_count += 1
+            if result is _NOT_STARTED:
+                # Never attempted because the login failed; counted as failed so the run status says so
+                failed_count += 1
+                logger.error("[%s/%s] Not downloaded (login failed): %s", processed_count, total_files, fname)
+                continue
+            if result:
+                downloaded_count += 1
+                logger.info("[%s/%s] Successfully downloaded to local storage: %s", processed_count, total_files, result)
+            else:
+                failed_count += 1
+                logger.error("[%s/%s] Failed to download %s after %s attempts.", processed_count, total_files, fname, max_retries)
 
     # Print summary
-    print(f"\n=== Download Summary ===")
-    print(f"Total files: {total_files}")
-    print(f"Downloaded: {downloaded_count}")
-    print(f"Skipped (already exist): {skipped_count}")
-    print(f"Failed: {failed_count}")
-    print(f"Processed: {processed_count}/{total_files}")
+    logger.info("\n=== Download Summary ===")
+    logger.info("Total files: %s", total_files)
+    logger.info("Downloaded: %s", downloaded_count)
+    logger.info("Skipped (already exist): %s", skipped_count)
+    logger.info("Failed: %s", failed_count)
+    logger.info("Processed: %s/%s", processed_count, total_files)
     if processed_count < total_files:
         remaining = total_files - processed_count
-        print(f"Remaining: {remaining} files (will be processed on next run)")
+        logger.info("Remaining: %s files (will be processed on next run)", remaining)
 
     return {
         "total_files": total_files,
@@ -386,329 +512,351 @@ def download_motion_files(motions, max_retries=None, retry_delay=None):
         "processed_count": processed_count,
     }
 
+def _get_telegram_loop():
+    """
+    Lazily start one event loop on a daemon thread for all Telegram sends.
+    Reusing the loop (and the Bot's HTTP client bound to it) avoids a new loop + TLS handshake per message.
+    """
+    global _TELEGRAM_LOOP
+    with _TELEGRAM_LOCK:
+        if _TELEGRAM_LOOP is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='telegram-loop', daemon=True).start()
+            _TELEGRAM_LOOP = loop
+            atexit.register(_close_telegram)
+    return _TELEGRAM_LOOP
+
+
+def _close_telegram():
+    loop = _TELEGRAM_LOOP
+    if loop is None:
+        return
+    # Sends are fire-and-forget, so this is where the run waits for them (terminal status included)
+    with _TELEGRAM_LOCK:
+        pending = list(_TELEGRAM_PENDING)
+    if pending:
+        _, not_done = concurrent.futures.wait(pending, timeout=TELEGRAM_SEND_TIMEOUT_SECONDS)
+        for future in not_done:
+            future.cancel()
+        if not_done:
+            logger.warning("%s Telegram notification(s) did not complete before exit", len(not_done))
+    if _TELEGRAM_BOT is not None:
+        try:
+            asyncio.run_coroutine_threadsafe(_TELEGRAM_BOT.shutdown(), loop).result(timeout=5)
+        except Exception:
+            pass
+    loop.call_soon_threadsafe(loop.stop)
+
+
 def send_telegram_message(message):
+    """
+    Queue a Telegram message on the shared loop and return its future right away, so the
+    download flow never waits on the Bot API. Messages go out one at a time, in order;
+    _close_telegram() waits for any still in flight at exit.
+    """
     async def _send():
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                bot = Bot(token=TELEGRAM_BOT_TOKEN)
-                await bot.send_message(chat_id=TELEGRAM_CHAT_ID, text=message)
-                print("Telegram notification sent.")
-                return True
-            except Exception as e:
-                print(f"Failed to send Telegram message (attempt {attempt + 1}/{max_retries}): {e}")
-                if attempt < max_retries - 1:
-                    await asyncio.sleep(5)  # Wait 5 seconds before retry
-        return False
-    return asyncio.run(_send())
+        global _TELEGRAM_BOT, _TELEGRAM_SEND_ORDER
+        if _TELEGRAM_SEND_ORDER is None:
+            _TELEGRAM_SEND_ORDER = asyncio.Lock()  # Created on the loop thread; waiters are served FIFO
+        async with _TELEGRAM_SEND_ORDER:
+            max_retries = 3
+            for attempt in range(max_retries):
+                try:
+                    if _TELEGRAM_BOT is None:
+                        _TELEGRAM_BOT = Bot(token=TELEGRAM_BOT_TOKEN)
+                    await _TELEGRAM_BOT.send_message(chat_id=TELEGRAM_CHAT_ID, text=message)
+                    logger.info("Telegram notification sent.")
+                    return True
+                except Exception as e:
+                    logger.error("Failed to send Telegram message (attempt %s/%s): %s", attempt + 1, max_retries, e)
+                    if attempt < max_retries - 1:
+                        await asyncio.sleep(5)  # Wait 5 seconds before retry
+            return False
+
+    future = asyncio.run_coroutine_threadsafe(_send(), _get_telegram_loop())
+    with _TELEGRAM_LOCK:
+        _TELEGRAM_PENDING.add(future)
+    future.add_done_callback(_forget_telegram_future)
+    return future
+
+
+def _forget_telegram_future(future):
+    with _TELEGRAM_LOCK:
+        _TELEGRAM_PENDING.discard(future)
+
+
+def accumulate_notification(message):
+    """Queue a progress line for the run's terminal status message instead of sending it on its own."""
+    _PENDING_NOTIFICATIONS.append(message)
 
 
 def send_terminal_status(message):
+    """
+    Send the run's final status, preceded by any accumulated progress lines, as one Telegram message.
+    If everything doesn't fit, the oldest progress lines are dropped.
+    """
     global TERMINAL_STATUS_SENT
     TERMINAL_STATUS_SENT = True
-    return send_telegram_message(message)
+    lines = list(_PENDING_NOTIFICATIONS)
+    _PENDING_NOTIFICATIONS.clear()
+    omitted = 0
+    while lines and len("\n".join(lines + [message])) + 40 > TELEGRAM_MAX_MESSAGE_LENGTH:
+        lines.pop(0)
+        omitted += 1
+    if omitted:
+        lines.insert(0, f"… {omitted} earlier updates omitted")
+    return send_telegram_message("\n".join(lines + [message]))
+
+@functools.lru_cache(maxsize=1)
+def load_time_windows():
+    """
+    Load download_times.json once and parse it into (start, end) datetime.time pairs.
+    Cached for the whole run so date loops don't re-read the file or re-run strptime.
+    """
+    with open('download_times.json', 'r') as f:
+        time_ranges = json.load(f)
+    return tuple(
+        (datetime.strptime(tr['start'], '%H:%M').time(), datetime.strptime(tr['end'], '%H:%M').time())
+        for tr in time_ranges
+    )
 
 def get_download_time_ranges():
     """Load and parse download time ranges from download_times.json for today."""
-    with open('download_times.json', 'r') as f:
-        time_ranges = json.load(f)
     today = datetime.now().date()
-    result = []
-    for tr in time_ranges:
-        start_dt = datetime.combine(today, datetime.strptime(tr['start'], '%H:%M').time())
-        end_dt = datetime.combine(today, datetime.strptime(tr['end'], '%H:%M').time())
-        result.append((start_dt, end_dt))
-    return result
+    return [
+        (datetime.combine(today, win_start), datetime.combine(today, win_end))
+        for win_start, win_end in load_time_windows()
+    ]
 
-def fetch_motion_files(cam, start_dt, end_dt, channel):
+def fetch_motion_files(cam, start_dt, end_dt, channel, streamtypes=None):
     """
     Query available motion files from Reolink camera for the given time range on the specified channel.
-    Tries both streamtype 'main' (Clear) and 'sub' (Fluent).
+    Tries each of streamtypes (default: PROBE_STREAMTYPES, i.e. 'main' (Clear); 'sub' is Fluent).
     Returns a dict with results for each streamtype.
     """
+    streamtypes = streamtypes or PROBE_STREAMTYPES
     results = {}
     try:
-        for streamtype in ['main', 'sub']:
+        for streamtype in streamtypes:
             motion_files = cam.get_motion_files(
                 start=start_dt,
                 end=end_dt,
                 channel=channel,
                 streamtype=streamtype
             )
-            print(f"Motion files from {start_dt} to {end_dt} | channel {channel} | streamtype '{streamtype}': {motion_files}")
+            logger.info("Motion files from %s to %s | channel %s | streamtype '%s': %s", start_dt, end_dt, channel, streamtype, motion_files)
             results[streamtype] = motion_files
         if not any(results.values()):
-            print(f"No motion files found for channel {channel}.")
+            logger.info("No motion files found for channel %s.", channel)
     except Exception as e:
-        print(f"Motion file search failed: {e}")
+        logger.error("Motion file search failed: %s", e)
         return None
     return results
 
-def process_date_range(start_date, end_date):
-    """
-    For each day in the range [start_date, end_date], fetch all motion files for the day (midnight to 23:59) for all channels, then filter by time windows before downloading.
-    """
-    from datetime import datetime as dt, time as dttime
-    current_date = start_date
-    while current_date <= end_date:
-        start = dt.combine(current_date, dt.min.time())
-        end = dt.combine(current_date, dttime(23, 59, 59))
-        print(f"\nProcessing date: {current_date.strftime('%Y-%m-%d')}")
-        print(f"Fetching all motion files for {start} to {end}")
-        cam = Camera(REOLINK_HOST, REOLINK_USER, REOLINK_PASSWORD, https=True, defer_login=True)
-        cam.login()
-        all_motions = []
-        for channel in [0, 1, 2, 3]:
-            motions = cam.get_motion_files(start=start, end=end, streamtype='main', channel=channel)
-            print(f"Channel {channel} motions: {motions}")
-            for motion in motions:
-                motion['channel'] = channel  # Tag channel for later
-            all_motions += motions
-        cam.logout()
+def _legacy_channel_motions(cam, channel, start, end):
+    """One channel's 'main' stream motion files via reolinkapi, tagged with the channel."""
+    motions = cam.get_motion_files(start=start, end=end, streamtype='main', channel=channel)
+    for motion in motions:
+        motion['channel'] = channel  # Tag channel for later, while the worker still holds the list
+    logger.info("Channel %s: %s motion files", channel, len(motions))
+    logger.debug("Channel %s motions: %s", channel, motions)
+    return motions
+
+async def _aio_channel_motions(host, channel, start, end):
+    """One channel's 'main' stream motion files via reolink-aio, as the same dicts reolinkapi returns."""
+    statuses, files = await host.request_vod_files(
+        channel=channel,
+        start=start,
+        end=end,
+        status_only=False,
+        stream='main',
+    )
+    motions = []
+    for f in files:
+        motions.append({
+            'start': f.start_time.astimezone().replace(tzinfo=None),
+            'end': f.end_time.astimezone().replace(tzinfo=None),
+            'filename': f.file_name,
+            'channel': channel,
+        })
+    logger.info("Channel %s: %s motion files", channel, len(motions))
+    logger.debug("Channel %s statuses: %s", channel, statuses)
+    logger.debug("Channel %s motions: %s", channel, motions)
+    return motions
+
+def query_channel_motions(channels, start, end):
+    """
+    Query several channels' motion files concurrently (one NVR round-trip each) with the configured client.
+    Returns {channel: motions list, or the exception that channel's query raised}, so callers can
+    retry just the channels that failed. A failed login is reported for every channel.
+    reolinkapi issues a stateless request per call, so one logged-in camera is shared by the workers.
+    """
+    try:
+        if USE_AIO_CLIENT:
+            async def _query():
+                host = await _get_aio_host()
+                return await asyncio.gather(
+                    *(_aio_channel_motions(host, channel, start, end) for channel in channels),
+                    return_exceptions=True,
+                )
+            results = _run_aio(_query())
+        else:
+            cam = get_camera()
+            futures = [_QUERY_EXECUTOR.submit(_legacy_channel_motions, cam, channel, start, end) for channel in channels]
+            results = [future.exception() or future.result() for future in futures]
+    except Exception as e:
+        results = [e] * len(channels)
+    return dict(zip(channels, results))
 
-        # Load time windows for the date
-        with open('download_times.json', 'r') as f:
-            time_ranges = json.load(f)
-        window_ranges = []
-        for tr in time_ranges:
-            win_start = dt.combine(current_date, dt.strptime(tr['start'], '%H:%M').time())
-            win_end = dt.combine(current_date, dt.strptime(tr['end'], '%H:%M').time())
-            window_ranges.append((win_start, win_end))
-
-        # Filter motions by time window
-        filtered_motions = []
-        for motion in all_motions:
-            mstart = motion['start']
-            for win_start, win_end in window_ranges:
-                if win_start <= mstart < win_end:
-                    filtered_motions.append(motion)
-                    break
-
-        print(f"Found {len(filtered_motions)} motion files in desired windows.")
-        for motion in filtered_motions:
-            fname = motion['filename']
-            channel = motion.get('channel', 'unknown')
-            mstart = motion['start']
-            output_filename = mstart.strftime("%Y-%m-%d %H-%M-%S") + f"_ch{channel}.mp4"
-            target_date = current_date  # for process_date_range
-            if not os.path.isfile(output_filename):
-                print(f"Downloading {fname} as {output_filename}")
-                cam = Camera(REOLINK_HOST, REOLINK_USER, REOLINK_PASSWORD, https=True, defer_login=True)
-                cam.login()
-                resp = cam.get_file(fname, output_path=output_filename)
-                cam.logout()
-                print(f"Downloaded to {output_filename}")
-                # Save to local storage
-                from local_storage import save_to_local_storage
-                result = save_to_local_storage(output_filename, target_date)
-                if result:
-                    print(f"Saved to local storage: {result}")
-                else:
-                    print("Failed to save to local storage.")
-            else:
-                print(f"File {output_filename} already exists, skipping download.")
-        current_date += timedelta(days=1)
-
-def process_date_with_window_filter(target_date):
-    """
-    Fetch all motion files for the given date (midnight to 23:59) for all channels, then filter by time windows before downloading.
-    """
-    from datetime import datetime as dt, time as dttime
-    start = dt.combine(target_date, dt.min.time())
-    end = dt.combine(target_date, dttime(23, 59, 59))
-    print(f"\nProcessing date: {target_date.strftime('%Y-%m-%d')}")
-    print(f"Fetching all motion files for {start} to {end}")
-    cam = Camera(REOLINK_HOST, REOLINK_USER, REOLINK_PASSWORD, https=True, defer_login=True)
-    cam.login()
-    all_motions = []
-    for channel in [0, 1, 2, 3]:
-        motions = cam.get_motion_files(start=start, end=end, streamtype='main', channel=channel)
-        print(f"Channel {channel} motions: {motions}")
-        for motion in motions:
-            motion['channel'] = channel  # Tag channel for later
-        all_motions += motions
-    cam.logout()
-
-    # Load time windows for the date
-    with open('download_times.json', 'r') as f:
-        time_ranges = json.load(f)
-    window_ranges = []
-    for tr in time_ranges:
-        win_start = dt.combine(target_date, dt.strptime(tr['start'], '%H:%M').time())
-        win_end = dt.combine(target_date, dt.strptime(tr['end'], '%H:%M').time())
-        window_ranges.append((win_start, win_end))
-
-    # Filter motions by time window
-    filtered_motions = []
-    for motion in all_motions:
-        mstart = motion['start']
-        for win_start, win_end in window_ranges:
-            if win_start <= mstart < win_end:
-                filtered_motions.append(motion)
-                break
+def daterange(start_date, end_date):
+    """Yield each date from start_date to end_date, inclusive."""
+    for offset in range((end_date - start_date).days + 1):
+        yield start_date + timedelta(days=offset)
 
-    print(f"Found {len(filtered_motions)} motion files in desired windows.")
-    for motion in filtered_motions:
-        fname = motion['filename']
-        channel = motion.get('channel', 'unknown')
-        mstart = motion['start']
-        output_filename = mstart.strftime("%Y-%m-%d %H-%M-%S") + f"_ch{channel}.mp4"
-        target_date = target_date  # for process_date_with_window_filter
-        if not os.path.isfile(output_filename):
-            print(f"Downloading {fname} as {output_filename}")
-            cam = Camera(REOLINK_HOST, REOLINK_USER, REOLINK_PASSWORD, https=True, defer_login=True)
-            cam.login()
-            resp = cam.get_file(fname, output_path=output_filename)
-            cam.logout()
-            print(f"Downloaded to {output_filename}")
-            # Save to local storage
-            from local_storage import save_to_local_storage
-            result = save_to_local_storage(output_filename, target_date)
-            if result:
-                print(f"Saved to local storage: {result}")
-            else:
-                print("Failed to save to local storage.")
-        else:
-            print(f"File {output_filename} already exists, skipping download.")
+def process_date(target_date, time_windows, channels=(0,)):
+    """
+    Fetch the motion files for one date, filter them by time windows and download the matches.
+    The single code path behind every run mode; clients and listings are shared across calls.
+    Returns (filtered_count, summary, fetch_error); summary is None when nothing was downloaded.
+    """
+    logger.info("\nProcessing %s", target_date)
+    motions, fetch_error = get_all_motion_files_for_date(target_date, channels=channels)
+    filtered = filter_motions_by_time_windows(motions, target_date, time_windows)
+    count = len(filtered)
+    logger.info("Found %s motion files in desired windows for %s.", count, target_date)
+    summary = None
+    if count > 0:
+        summary = download_motion_files(filtered)
+    return count, summary, fetch_error
+
+def process_date_range(start_date, end_date, channels=MOTION_CHANNELS):
+    """
+    For each day in the range [start_date, end_date], fetch all motion files for the day for all channels, then filter by time windows before downloading.
+    """
+    time_windows = load_time_windows()
+    for target_date in daterange(start_date, end_date):
+        process_date(target_date, time_windows, channels)
+
+def process_date_with_window_filter(target_date, channels=MOTION_CHANNELS):
+    """
+    Fetch all motion files for the given date for all channels, then filter by time windows before downloading.
+    """
+    process_date(target_date, load_time_windows(), channels)
 
-def get_all_motion_files_for_date(target_date, max_retries=3, retry_delay=30):
+def get_all_motion_files_for_date(target_date, max_retries=3, retry_delay=30, channels=(0,)):
     """
     Fetches all motion files for the given date with retry logic.
-    Adds a delay for today's date to allow for camera indexing.
-    Only checks channel 0.
+    Channels are queried concurrently and retried individually: a later attempt only re-queries the
+    channels that errored (or, while nothing has been found yet, the ones that came back empty).
+    For today's date an empty result is retried after a short backoff (1s, 2s, 4s... capped, plus jitter)
+    in case the camera hasn't finished indexing recent clips.
+    Only checks channel 0 unless other channels are given.
 
     Returns: (motions_list, fetch_error)
       - fetch_error is None on success/no-data
       - fetch_error is a string when repeated API/transport errors occurred
     """
-    all_motions = []
+    found = {}  # channel -> motions, for channels that answered
     last_error = None
 
+    is_today = target_date == datetime.now().date()
+    start_dt = datetime.combine(target_date, dttime.min)
+    end_dt = datetime.combine(target_date, dttime.max)
+
+    pending = tuple(channels)
     for attempt in range(max_retries):
-        try:
-            today = datetime.now().date()
-            if target_date == today:
-                print("Checking today's motions, adding delay for indexing...")
-                time.sleep(10)
+        errors = {}
+        for channel, result in query_channel_motions(pending, start_dt, end_dt).items():
+            if isinstance(result, Exception):
+                errors[channel] = result
+            else:
+                found[channel] = result
+        have_motions = any(found.values())
 
-            start_dt = datetime.combine(target_date, datetime.min.time())
-            end_dt = datetime.combine(target_date, datetime.max.time())
+        if not errors and have_motions:
+            return [motion for channel in channels for motion in found.get(channel, ())], None
 
+        if errors:
+            for channel, e in errors.items():
+                logger.error("Error fetching channel %s motions on attempt %s: %s", channel, attempt + 1, e)
+            last_error = str(next(iter(errors.values())))
+            # Retry with a fresh login rather than a possibly stale session
             if USE_AIO_CLIENT:
-                from reolink_aio.api import Host
-
-                async def _fetch_via_aio():
-                    host = Host(REOLINK_HOST, REOLINK_USER, REOLINK_PASSWORD, use_https=None, port=None, stream='main', timeout=10)
-                    try:
-                        await host.login()
-                        await host.get_host_data()
-                        statuses, files = await host.request_vod_files(
-                            channel=0,
-                            start=start_dt,
-                            end=end_dt,
-                            status_only=False,
-                            stream='main',
-                        )
-                        motions = []
-                        for f in files:
-                            motions.append({
-                                'start': f.start_time.astimezone().replace(tzinfo=None),
-                                'end': f.end_time.astimezone().replace(tzinfo=None),
-                                'filename': f.file_name,
-                                'channel': 0,
-                            })
-                        print(f"Channel 0 statuses: {statuses}")
-                        print(f"Channel 0 motions: {motions}")
-                        return motions
-                    finally:
-                        try:
-                            await host.logout()
-                        except Exception:
-                            pass
-
-                all_motions = asyncio.run(_fetch_via_aio())
+                _run_aio(_reset_aio_host())
             else:
-                cam = Camera(REOLINK_HOST, REOLINK_USER, REOLINK_PASSWORD, https=True, defer_login=True)
-                cam.login()
-                print("Login success")
-                try:
-                    channel_motions = cam.get_motion_files(
-                        start=start_dt,
-                        end=end_dt,
-                        streamtype='main',
-                        channel=0
-                    )
-                    print(f"Channel 0 motions: {channel_motions}")
-                    for motion in channel_motions:
-                        motion['channel'] = 0
-                    all_motions.extend(channel_motions)
-                finally:
-                    try:
-                        cam.logout()
-                    except Exception:
-                        pass
-
-            if all_motions:
-                return all_motions, None
-
-            print(f"No motions found on attempt {attempt + 1}")
-            if attempt < max_retries - 1:
-                delay = compute_retry_delay(retry_delay, attempt)
-                print(f"Retrying in {delay} seconds...")
-                time.sleep(delay)
+                reset_camera()
+            if not all(is_retryable_exception(e) for e in errors.values()):
+                logger.error("Non-retryable fetch error encountered, stopping retries.")
+                break
+        else:
+            logger.warning("No motions found on attempt %s", attempt + 1)
 
-        except Exception as e:
-            last_error = str(e)
-            print(f"Error fetching motions on attempt {attempt + 1}: {e}")
-            if attempt < max_retries - 1 and is_retryable_exception(e):
+        if attempt < max_retries - 1:
+            if errors:
                 delay = compute_retry_delay(retry_delay, attempt)
-                print(f"Retrying in {delay} seconds...")
-                time.sleep(delay)
-            elif not is_retryable_exception(e):
-                print("Non-retryable fetch error encountered, stopping retries.")
-                break
+            elif is_today:
+                # Recent clips may still be indexing; poll again shortly rather than waiting blindly
+                delay = round(min(2 ** attempt, INDEXING_WAIT_MAX_SECONDS) + random.uniform(0, 0.5), 1)
+            else:
+                delay = compute_retry_delay(retry_delay, attempt)
+            logger.warning("Retrying in %s seconds...", delay)
+            time.sleep(delay)
+            # Errored channels always; empty ones only while nothing has turned up anywhere
+            pending = tuple(
+                channel for channel in channels
+                if channel in errors or (not have_motions and not found.get(channel))
+            )
 
     if last_error:
-        print(f"Failed to fetch motions after {max_retries} attempts")
-    return all_motions, last_error
+        logger.error("Failed to fetch motions after %s attempts", max_retries)
+    return [motion for channel in channels for motion in found.get(channel, ())], last_error
 
-def filter_motions_by_time_windows(motions, target_date, time_windows):
+def merge_time_windows(window_ranges):
     """
-    Filter a list of motion dicts to only those whose 'start' time falls within any of the specified time windows.
-    time_windows: list of dicts with 'start' and 'end' in 'HH:MM' format.
-    Only processes channel 0 motions.
+    Sort (start, end) windows and merge overlapping/adjacent ones.
+    Empty windows (start >= end) never match a motion and are dropped.
     """
-    from datetime import datetime as dt
-    window_ranges = []
-    for tr in time_windows:
-        win_start = dt.combine(target_date, dt.strptime(tr['start'], '%H:%M').time())
-        win_end = dt.combine(target_date, dt.strptime(tr['end'], '%H:%M').time())
-        window_ranges.append((win_start, win_end))
+    merged = []
+    for win_start, win_end in sorted(w for w in window_ranges if w[0] < w[1]):
+        if merged and win_start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], win_end))
+        else:
+            merged.append((win_start, win_end))
+    return merged
 
-    filtered = []
-    for motion in motions:
-        mstart = motion['start']
-        for win_start, win_end in window_ranges:
-            if win_start <= mstart < win_end:
-                filtered.append(motion)
-                break
+@functools.lru_cache(maxsize=8)
+def _merged_time_windows(time_windows):
+    """merge_time_windows() on time-of-day pairs, done once per window set rather than once per date."""
+    return tuple(merge_time_windows(time_windows))
 
-    return filtered
+def filter_motions_by_time_windows(motions, target_date, time_windows):
+    """
+    Filter a list of motion dicts to only those whose 'start' time falls within any of the specified time windows.
+    time_windows: (start, end) datetime.time pairs, as returned by load_time_windows().
+    Motions from every channel are filtered alike; the channel is not looked at.
+    """
+    # Sorted, non-overlapping windows flattened to [start0, end0, start1, end1, ...]: a motion is
+    # inside a window exactly when an odd number of boundaries are <= its start
+    bounds = [
+        datetime.combine(target_date, bound)
+        for window in _merged_time_windows(tuple(time_windows))
+        for bound in window
+    ]
+    return [motion for motion in motions if bisect_right(bounds, motion['start']) & 1]
 
 
 if __name__ == "__main__":
-    import argparse
-    from datetime import datetime as dt, timedelta
     parser = argparse.ArgumentParser(description="Download and filter Reolink motion files by time windows.")
     parser.add_argument('--start', type=str, help='Start date (YYYY-MM-DD)', required=False)
     parser.add_argument('--end', type=str, help='End date (YYYY-MM-DD)', required=False)
     args = parser.parse_args()
 
+    setup_logging()
+
     # Load time windows from download_times.json
-    with open('download_times.json', 'r') as f:
-        time_windows = json.load(f)
+    time_windows = load_time_windows()
 
-    JOB_RUN_ID = dt.now().strftime("%Y%m%d-%H%M%S")
+    JOB_RUN_ID = datetime.now().strftime("%Y%m%d-%H%M%S")
     TERMINAL_STATUS_SENT = False
 
     # Register termination handlers so interrupted runs still send terminal status.
@@ -717,91 +865,70 @@ if __name__ == "__main__":
     signal.signal(signal.SIGHUP, _termination_handler)
     signal.signal(signal.SIGQUIT, _termination_handler)
 
+    if USE_AIO_CLIENT and Host is None:
+        logger.error("Error: REOLINK_CLIENT=aio requires the reolink-aio package (pip install reolink-aio) or set REOLINK_CLIENT=legacy.")
+        exit(1)
+
     try:
-        print(f"Reolink client mode: {REOLINK_CLIENT}")
+        logger.info("Reolink client mode: %s", REOLINK_CLIENT)
         job_run_id = JOB_RUN_ID
         # Send start notification
         send_telegram_message(f"🎥 [STARTED] Reolink video processing (job={job_run_id}, client={REOLINK_CLIENT})")
 
-        if args.start and args.end:
-            start_date = dt.strptime(args.start, "%Y-%m-%d").date()
-            end_date = dt.strptime(args.end, "%Y-%m-%d").date()
-            if start_date == end_date:
-                print(f"\nProcessing {start_date}")
-                motions, fetch_error = get_all_motion_files_for_date(start_date)
-                filtered = filter_motions_by_time_windows(motions, start_date, time_windows)
-                count = len(filtered)
-                print(f"Found {count} motion files in desired windows for {start_date}.")
-                if count > 0:
-                    send_telegram_message(f"📥 Processing {count} videos from {start_date}...")
-                    summary = download_motion_files(filtered)
-                    send_terminal_status(
-                        f"✅ [COMPLETED] job={job_run_id} date={start_date} total={summary['total_files']} downloaded={summary['downloaded_count']} skipped={summary['skipped_count']} failed={summary['failed_count']} processed={summary['processed_count']}"
-                    )
-                else:
-                    if fetch_error:
-                        send_terminal_status(f"❌ [FAILED] job={job_run_id} date={start_date} fetch_error={fetch_error}")
-                        raise RuntimeError(f"Motion fetch failed for {start_date}: {fetch_error}")
-                    send_terminal_status(f"✅ [COMPLETED] job={job_run_id} date={start_date} no_new_videos_in_time_windows")
-            else:
-                current_date = start_date
-                total_downloaded = 0
-                total_skipped = 0
-                total_failed = 0
-                total_processed = 0
-                failed_dates = []
-                while current_date <= end_date:
-                    print(f"\nProcessing {current_date}")
-                    motions, fetch_error = get_all_motion_files_for_date(current_date)
-                    filtered = filter_motions_by_time_windows(motions, current_date, time_windows)
-                    count = len(filtered)
-                    print(f"Found {count} motion files in desired windows for {current_date}.")
-                    if count > 0:
-                        send_telegram_message(f"📥 Processing {count} videos from {current_date}...")
-                        summary = download_motion_files(filtered)
-                        total_downloaded += summary['downloaded_count']
-                        total_skipped += summary['skipped_count']
-                        total_failed += summary['failed_count']
-                        total_processed += summary['processed_count']
-                    elif fetch_error:
-                        failed_dates.append(f"{current_date}: {fetch_error}")
-                    current_date += timedelta(days=1)
-
-                if failed_dates:
-                    send_terminal_status(
-                        f"❌ [FAILED] job={job_run_id} range={start_date}->{end_date} errors={'; '.join(failed_dates)}"
-                    )
-                    raise RuntimeError(f"Fetch failures in range run: {'; '.join(failed_dates)}")
-
-                if total_processed > 0:
-                    send_terminal_status(
-                        f"✅ [COMPLETED] job={job_run_id} range={start_date}->{end_date} downloaded={total_downloaded} skipped={total_skipped} failed={total_failed} processed={total_processed}"
-                    )
-                else:
-                    send_terminal_status(
-                        f"✅ [COMPLETED] job={job_run_id} range={start_date}->{end_date} no_new_videos_in_time_windows"
-                    )
-        elif args.start or args.end:
-            print("Error: You must specify BOTH --start and --end to use date range mode.")
-            exit(1)
+        if args.start or args.end:
+            if not (args.start and args.end):
+                logger.error("Error: You must specify BOTH --start and --end to use date range mode.")
+                exit(1)
+            start_date = datetime.strptime(args.start, "%Y-%m-%d").date()
+            end_date = datetime.strptime(args.end, "%Y-%m-%d").date()
         else:
-            today = dt.now().date()
-            print(f"\nProcessing {today}")
-            motions, fetch_error = get_all_motion_files_for_date(today)
-            filtered = filter_motions_by_time_windows(motions, today, time_windows)
-            count = len(filtered)
-            print(f"Found {count} motion files in desired windows for today.")
-            if count > 0:
-                send_telegram_message(f"📥 Processing {count} videos from today...")
-                summary = download_motion_files(filtered)
+            start_date = end_date = datetime.now().date()
+
+        if start_date == end_date:
+            count, summary, fetch_error = process_date(start_date, time_windows)
+            if count:
+                accumulate_notification(f"📥 Processing {count} videos from {start_date}...")
+            if summary:
                 send_terminal_status(
-                    f"✅ [COMPLETED] job={job_run_id} date={today} total={summary['total_files']} downloaded={summary['downloaded_count']} skipped={summary['skipped_count']} failed={summary['failed_count']} processed={summary['processed_count']}"
+                    f"✅ [COMPLETED] job={job_run_id} date={start_date} total={summary['total_files']} downloaded={summary['downloaded_count']} skipped={summary['skipped_count']} failed={summary['failed_count']} processed={summary['processed_count']}"
                 )
             else:
                 if fetch_error:
-                    send_terminal_status(f"❌ [FAILED] job={job_run_id} date={today} fetch_error={fetch_error}")
-                    raise RuntimeError(f"Motion fetch failed for {today}: {fetch_error}")
-                send_terminal_status(f"✅ [COMPLETED] job={job_run_id} date={today} no_new_videos_in_time_windows")
+                    send_terminal_status(f"❌ [FAILED] job={job_run_id} date={start_date} fetch_error={fetch_error}")
+                    raise RuntimeError(f"Motion fetch failed for {start_date}: {fetch_error}")
+                send_terminal_status(f"✅ [COMPLETED] job={job_run_id} date={start_date} no_new_videos_in_time_windows")
+        else:
+            total_downloaded = 0
+            total_skipped = 0
+            total_failed = 0
+            total_processed = 0
+            failed_dates = []
+            for current_date in daterange(start_date, end_date):
+                count, summary, fetch_error = process_date(current_date, time_windows)
+                if count:
+                    accumulate_notification(f"📥 Processing {count} videos from {current_date}...")
+                if summary:
+                    total_downloaded += summary['downloaded_count']
+                    total_skipped += summary['skipped_count']
+                    total_failed += summary['failed_count']
+                    total_processed += summary['processed_count']
+                elif fetch_error:
+                    failed_dates.append(f"{current_date}: {fetch_error}")
+
+            if failed_dates:
+                send_terminal_status(
+                    f"❌ [FAILED] job={job_run_id} range={start_date}->{end_date} errors={'; '.join(failed_dates)}"
+                )
+                raise RuntimeError(f"Fetch failures in range run: {'; '.join(failed_dates)}")
+
+            if total_processed > 0:
+                send_terminal_status(
+                    f"✅ [COMPLETED] job={job_run_id} range={start_date}->{end_date} downloaded={total_downloaded} skipped={total_skipped} failed={total_failed} processed={total_processed}"
+                )
+            else:
+                send_terminal_status(
+                    f"✅ [COMPLETED] job={job_run_id} range={start_date}->{end_date} no_new_videos_in_time_windows"
+                )
     except KeyboardInterrupt as e:
         signal_info = f"signal={TERMINATION_SIGNAL}" if TERMINATION_SIGNAL else "signal=keyboard_interrupt"
         send_terminal_status(f"⚠ [ABORTED] job={JOB_RUN_ID} {signal_info} reason={e}")
@@ -810,6 +937,7 @@ if __name__ == "__main__":
         send_terminal_status(f"❌ [FAILED] Reolink automation job failed: {e}")
         raise
     finally:
+        flush_nextcloud_scans()
         # If the process exits without an explicit terminal status, send one to avoid ghost runs.
         if JOB_RUN_ID and not TERMINAL_STATUS_SENT:
             send_terminal_status(f"⚠ [ABORTED] job={JOB_RUN_ID} reason=process_exited_without_terminal_status")
\ No newline at end of file